@@ -1,7 +1,7 @@
 import json
 import os
 import glob
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from PIL import Image
 import numpy as np
@@ -25,6 +25,14 @@ def sun_angle(time: datetime, lat: float = 42.4440, lon: float = -76.5019):
     return azimuth, altitude
 
 
+def normalized_sun_angle(time: datetime) -> Tuple[float, float]:
+    """
+    Returns the sun azimuth and altitude normalized to [0, 1]
+    """
+    azimuth, altitude = sun_angle(time)
+    return azimuth / 360, altitude / 90
+
+
 def datetime_to_relative(
     date: datetime, start_date: datetime, end_date: datetime
 ) -> float:
@@ -72,10 +80,7 @@ class TimeLapseDataset:
                 date = datetime.strptime(date, "%Y-%m-%d-%H-%M-%S")
             dates.append(date)
 
-            azimuth, altitude = sun_angle(date)
-            azimuth, altitude = azimuth / 360, altitude / 90  # normalize to [0, 1]
-            angle = [azimuth, altitude]
-            sun_angles.append(angle)
+            sun_angles.append(list(normalized_sun_angle(date)))
 
         start_date: datetime = min(dates)
         end_date: datetime = max(dates)
@@ -124,7 +129,9 @@ class TimeLapseDataset:
                 ),
                 Image.BICUBIC,
             )
-        image = np.array(image).astype(np.float32)
+        # Kept as uint8 so that batches are 4x smaller to pin and transfer,
+        # the division by 255 happens on the GPU.
+        image = np.asarray(image, dtype=np.uint8)
         if image.shape[0] > image.shape[1]:  # if height > width, rotate
             image = np.rot90(
                 image, k=1, axes=(0, 1)
@@ -133,7 +140,7 @@ class TimeLapseDataset:
         if image.shape[2] == 4:  # check if image has alpha channel
             alpha = image[..., 3:4]
         else:
-            alpha = np.ones((image.shape[0], image.shape[1], 1), dtype=image.dtype)
+            alpha = np.full((image.shape[0], image.shape[1], 1), 255, dtype=np.uint8)
         image = image[..., :3]  # remove alpha channel if present
 
         time = self.dates[index]
@@ -162,12 +169,54 @@ class TimeLapseDataset:
         data = {
             "K": torch.from_numpy(K).float(),
             "camtoworld": torch.from_numpy(camtoworlds).float(),
-            "image": torch.from_numpy(image).float(),
+            "image": torch.from_numpy(np.ascontiguousarray(image)),
             "image_id": index,  # the index of the image in the dataset
             "sun_angle": torch.tensor(angle).float(),
             "time": time,
             "clouds": clouds,
-            "alpha": torch.from_numpy(alpha).float(),
+            "alpha": torch.from_numpy(np.ascontiguousarray(alpha)),
         }
 
         return data
+
+
+class CUDAPrefetcher:
+    """Cycles over a DataLoader, copying the next batch to the GPU on a side stream.
+
+    The copy of batch i + 1 is issued as soon as batch i is handed out, so the
+    host-to-device transfer overlaps with the training step. The loader should
+    use pinned memory for the copies to be asynchronous.
+    """
+
+    def __init__(self, loader, device: str = "cuda"):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream()
+        self._iter = iter(loader)
+        self._preload()
+
+    def _preload(self):
+        try:
+            data = next(self._iter)
+        except StopIteration:
+            self._iter = iter(self.loader)
+            data = next(self._iter)
+        with torch.cuda.stream(self.stream):
+            self._next = {
+                k: (
+                    v.to(self.device, non_blocking=True)
+                    if isinstance(v, torch.Tensor)
+                    else v
+                )
+                for k, v in data.items()
+            }
+
+    def next(self) -> Dict[str, Any]:
+        stream = torch.cuda.current_stream()
+        stream.wait_stream(self.stream)
+        data = self._next
+        for v in data.values():
+            if isinstance(v, torch.Tensor):
+                v.record_stream(stream)
+        self._preload()
+        return data
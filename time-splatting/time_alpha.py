@@ -0,0 +1,271 @@
+from typing import Optional
+
+import torch
+import triton
+import triton.language as tl
+from torch import Tensor
+
+BLOCK = 1024
+
+
+@triton.jit
+def _sq_dist(t_ptr, m_ptr, ls_ptr, offs, mask, D: tl.constexpr, BLOCK: tl.constexpr):
+    # sum_j ((t_j - m_ij) / exp(ls_ij))^2 over the D columns of each row
+    acc = tl.zeros((BLOCK,), dtype=tl.float32)
+    for j in tl.static_range(D):
+        t = tl.load(t_ptr + j)
+        m = tl.load(m_ptr + offs * D + j, mask=mask, other=0.0)
+        ls = tl.load(ls_ptr + offs * D + j, mask=mask, other=0.0)
+        z = (t - m) * tl.exp(-ls)
+        acc += z * z
+    return acc
+
+
+@triton.jit
+def _sq_dist_bwd(
+    t_ptr,
+    m_ptr,
+    ls_ptr,
+    grad_m_ptr,
+    grad_ls_ptr,
+    g_out,
+    offs,
+    mask,
+    D: tl.constexpr,
+):
+    for j in tl.static_range(D):
+        t = tl.load(t_ptr + j)
+        m = tl.load(m_ptr + offs * D + j, mask=mask, other=0.0)
+        ls = tl.load(ls_ptr + offs * D + j, mask=mask, other=0.0)
+        inv_s = tl.exp(-ls)
+        z = (t - m) * inv_s
+        tl.store(grad_m_ptr + offs * D + j, g_out * z * inv_s, mask=mask)
+        tl.store(grad_ls_ptr + offs * D + j, g_out * z * z, mask=mask)
+
+
+@triton.jit
+def _time_alpha_fwd_kernel(
+    times_ptr,
+    means_ptr,
+    log_scales_ptr,
+    sun_ptr,
+    sun_means_ptr,
+    log_sun_scales_ptr,
+    opacities_ptr,
+    out_ptr,
+    N,
+    D: tl.constexpr,
+    DS: tl.constexpr,
+    BLOCK: tl.constexpr,
+):
+    offs = tl.program_id(0) * BLOCK + tl.arange(0, BLOCK)
+    mask = offs < N
+
+    acc = _sq_dist(times_ptr, means_ptr, log_scales_ptr, offs, mask, D, BLOCK)
+    acc += _sq_dist(sun_ptr, sun_means_ptr, log_sun_scales_ptr, offs, mask, DS, BLOCK)
+    alpha = tl.exp(-0.5 * acc)
+
+    op = tl.load(opacities_ptr + offs, mask=mask, other=0.0)
+    out = alpha / (1.0 + tl.exp(-op))
+    tl.store(out_ptr + offs, out, mask=mask)
+
+
+@triton.jit
+def _time_alpha_bwd_kernel(
+    times_ptr,
+    means_ptr,
+    log_scales_ptr,
+    sun_ptr,
+    sun_means_ptr,
+    log_sun_scales_ptr,
+    opacities_ptr,
+    grad_out_ptr,
+    grad_means_ptr,
+    grad_log_scales_ptr,
+    grad_sun_means_ptr,
+    grad_log_sun_scales_ptr,
+    grad_opacities_ptr,
+    N,
+    D: tl.constexpr,
+    DS: tl.constexpr,
+    BLOCK: tl.constexpr,
+):
+    offs = tl.program_id(0) * BLOCK + tl.arange(0, BLOCK)
+    mask = offs < N
+
+    # Recompute alpha instead of storing it in the forward pass.
+    acc = _sq_dist(times_ptr, means_ptr, log_scales_ptr, offs, mask, D, BLOCK)
+    acc += _sq_dist(sun_ptr, sun_means_ptr, log_sun_scales_ptr, offs, mask, DS, BLOCK)
+    alpha = tl.exp(-0.5 * acc)
+
+    op = tl.load(opacities_ptr + offs, mask=mask, other=0.0)
+    sig = 1.0 / (1.0 + tl.exp(-op))
+    g = tl.load(grad_out_ptr + offs, mask=mask, other=0.0)
+    g_out = g * sig * alpha
+
+    tl.store(grad_opacities_ptr + offs, g_out * (1.0 - sig), mask=mask)
+    _sq_dist_bwd(
+        times_ptr,
+        means_ptr,
+        log_scales_ptr,
+        grad_means_ptr,
+        grad_log_scales_ptr,
+        g_out,
+        offs,
+        mask,
+        D,
+    )
+    _sq_dist_bwd(
+        sun_ptr,
+        sun_means_ptr,
+        log_sun_scales_ptr,
+        grad_sun_means_ptr,
+        grad_log_sun_scales_ptr,
+        g_out,
+        offs,
+        mask,
+        DS,
+    )
+
+
+class _TimeAlphaOpacity(torch.autograd.Function):
+    @staticmethod
+    def forward(
+        ctx,
+        times: Tensor,
+        time_means: Tensor,
+        log_time_scales: Tensor,
+        sun_angles: Tensor,
+        sun_means: Tensor,
+        log_sun_scales: Tensor,
+        opacities: Tensor,
+    ) -> Tensor:
+        N, D = time_means.shape
+        DS = sun_means.shape[-1]
+        out = torch.empty_like(opacities)
+        grid = (triton.cdiv(N, BLOCK),)
+        _time_alpha_fwd_kernel[grid](
+            times,
+            time_means,
+            log_time_scales,
+            sun_angles,
+            sun_means,
+            log_sun_scales,
+            opacities,
+            out,
+            N,
+            D=D,
+            DS=DS,
+            BLOCK=BLOCK,
+        )
+        ctx.save_for_backward(
+            times,
+            time_means,
+            log_time_scales,
+            sun_angles,
+            sun_means,
+            log_sun_scales,
+            opacities,
+        )
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out: Tensor):
+        (
+            times,
+            time_means,
+            log_time_scales,
+            sun_angles,
+            sun_means,
+            log_sun_scales,
+            opacities,
+        ) = ctx.saved_tensors
+        N, D = time_means.shape
+        DS = sun_means.shape[-1]
+        grad_means = torch.empty_like(time_means)
+        grad_log_scales = torch.empty_like(log_time_scales)
+        grad_sun_means = torch.empty_like(sun_means)
+        grad_log_sun_scales = torch.empty_like(log_sun_scales)
+        grad_opacities = torch.empty_like(opacities)
+        grid = (triton.cdiv(N, BLOCK),)
+        _time_alpha_bwd_kernel[grid](
+            times,
+            time_means,
+            log_time_scales,
+            sun_angles,
+            sun_means,
+            log_sun_scales,
+            opacities,
+            grad_out.contiguous(),
+            grad_means,
+            grad_log_scales,
+            grad_sun_means,
+            grad_log_sun_scales,
+            grad_opacities,
+            N,
+            D=D,
+            DS=DS,
+            BLOCK=BLOCK,
+        )
+        grads = (
+            None,
+            grad_means,
+            grad_log_scales,
+            None,
+            grad_sun_means,
+            grad_log_sun_scales,
+            grad_opacities,
+        )
+        return tuple(
+            g if needs_grad else None
+            for g, needs_grad in zip(grads, ctx.needs_input_grad)
+        )
+
+
+def time_alpha_opacity(
+    times: Tensor,
+    time_means: Tensor,
+    log_time_scales: Tensor,
+    opacities: Tensor,
+    sun_angles: Optional[Tensor] = None,
+    sun_means: Optional[Tensor] = None,
+    log_sun_scales: Optional[Tensor] = None,
+) -> Tensor:
+    """Fused `sigmoid(opacities) * exp(-0.5 * (|dt / s_t|^2 + |da / s_a|^2))`.
+
+    Reads each [N, d] row once and writes one opacity per Gaussian, instead of
+    materializing the time deltas and alphas as separate [N, d] and [N] tensors
+    (the same memory-traffic argument as FlashAttention-style fusion). The sun
+    angle term is optional and only used by the shading splats.
+
+    Args:
+        times: (d,) or (1,) time of the rendered view
+        time_means: (N, d) time means of the Gaussians
+        log_time_scales: (N, d) log time scales of the Gaussians
+        opacities: (N,) opacity logits
+        sun_angles: (2,) sun angles of the rendered view
+        sun_means: (N, 2) sun angle means of the Gaussians
+        log_sun_scales: (N, 2) log sun angle scales of the Gaussians
+
+    Returns:
+        opacities: (N,) time-modulated opacities
+    """
+    assert (sun_means is None) == (
+        sun_angles is None
+    ), "sun_angles must be given exactly when the splats have sun_means."
+    N, d = time_means.shape
+    times = times.reshape(-1).float().expand(d).contiguous()
+    if sun_angles is None:
+        sun_angles = times.new_empty(0)
+        sun_means = log_sun_scales = time_means.new_empty((N, 0))
+    else:
+        sun_angles = sun_angles.reshape(-1).float().contiguous()
+    return _TimeAlphaOpacity.apply(
+        times,
+        time_means.contiguous(),
+        log_time_scales.contiguous(),
+        sun_angles,
+        sun_means.contiguous(),
+        log_sun_scales.contiguous(),
+        opacities.contiguous(),
+    )
@@ -1,8 +1,11 @@
 import json
 import math
 import os
+import queue
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
@@ -15,7 +18,7 @@ import tqdm
 import tyro
 import viser
 import yaml
-from dataloader import TimeLapseDataset, sun_angle
+from dataloader import CUDAPrefetcher, TimeLapseDataset, normalized_sun_angle
 
 from fused_ssim import fused_ssim
 from torch import Tensor
@@ -23,7 +26,13 @@ from torch.utils.tensorboard import SummaryWriter
 from torchmetrics.image import PeakSignalNoiseRatio, StructuralSimilarityIndexMeasure
 from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
 from typing_extensions import Literal, assert_never
-from utils import AppearanceOptModule, knn, set_random_seed
+from utils import (
+    AppearanceOptModule,
+    generate_interpolated_path,
+    knn,
+    se3_inverse,
+    set_random_seed,
+)
 
 from gsplat import export_splats
 from gsplat.compression import PngCompression
@@ -34,7 +43,6 @@ from gsplat.strategy import DefaultStrategy, MCMCStrategy
 from gsplat_viewer import GsplatViewer, GsplatRenderTabState
 from nerfview import CameraState, apply_float_colormap
 from datetime import datetime, timedelta
-import bisect
 
 
 @dataclass
@@ -45,8 +53,16 @@ class Config:
     ckpt: Optional[List[str]] = None
     # Name of compression strategy to use
     compression: Optional[Literal["png"]] = None
+    # Evaluate the decompressed splats after compression
+    eval_after_compression: bool = False
+    # Disable trajectory video rendering
+    disable_video: bool = False
     # Render trajectory path
-    render_traj_path: str = "interp"
+    render_traj_path: Literal["interp"] = "interp"
+    # Number of trajectory frames per key camera pose
+    traj_frames_per_pose: int = 120
+    # Number of trajectory frames rasterized together
+    traj_batch_size: int = 8
 
     # Path to the time-lapse dataset
     data_dir: str = "../../gsplat/examples/data/sunnyhoy_cropped_new"
@@ -68,6 +84,8 @@ class Config:
     max_steps: int = 30_000
     # Steps to evaluate the model
     eval_steps: List[int] = field(default_factory=lambda: [])
+    # Number of validation images scored together by the image metrics
+    metrics_batch_size: int = 4
     # Steps to save the model
     save_steps: List[int] = field(default_factory=lambda: [])
     # Whether to save ply file (storage size can be large)
@@ -113,6 +131,10 @@ class Config:
     sparse_grad: bool = False
     # Use visible adam from Taming 3DGS. (experimental)
     visible_adam: bool = False
+    # Fuse elementwise splat activations with torch.compile. (experimental)
+    compile: bool = False
+    # Evaluate the time-modulated opacities with a fused Triton kernel. (experimental)
+    fused_time_alpha: bool = False
 
     # LR for 3D point positions
     means_lr: float = 1.6e-4
@@ -148,6 +170,8 @@ class Config:
     tb_every: int = 100
     # Save training images to tensorboard
     tb_save_image: bool = False
+    # Show the loss in the progress bar every this steps
+    pbar_every: int = 10
 
     lpips_net: Literal["vgg", "alex"] = "alex"
 
@@ -199,10 +223,10 @@ def create_splats_with_optimizers(
         rgbs = torch.rand((init_num_pts, 1))
     else:
         rgbs = torch.rand((init_num_pts, 3))
-    colors = torch.logit(rgbs)
+    colors = rgbs.logit_()
 
     # Initialize the GS size to be the average dist of the 3 nearest neighbors
-    dist2_avg = (knn(points[:, :2], 4)[:, 1:] ** 2).mean(dim=-1)  # [N,]
+    dist2_avg = (knn(points[:, :2].to(device), 4)[:, 1:] ** 2).mean(dim=-1)  # [N,]
     dist_avg = torch.sqrt(dist2_avg)
 
     if use_shading:
@@ -211,18 +235,24 @@ def create_splats_with_optimizers(
 
     N = points.shape[0]
     quats = torch.rand((N, 4))  # [N, 4]
-    opacities = torch.logit(torch.full((N,), init_opacity))  # [N,]
+    opacities = torch.full((N,), math.log(init_opacity / (1 - init_opacity)))  # [N,]
 
-    # Time parameters
-    times = np.random.choice(dataset.dates, size=(N, 1))
-    times = torch.tensor(times).float()
+    # Time parameters, sampled on device from the dates of the dataset
+    dates = torch.as_tensor(dataset.dates, dtype=torch.float32, device=device)
+    times = dates[torch.randint(0, len(dates), (N,), device=device)]
+    times = times.unsqueeze(-1)  # [N, 1]
 
     if use_shading:
-        sun_azimuth = np.random.choice(dataset.sun_angles[:, 0], size=(N, 1))
-        sun_altitude = np.random.choice(dataset.sun_angles[:, 1], size=(N, 1))
-        sun_angles = np.concatenate([sun_azimuth, sun_altitude], axis=-1)
-        sun_angles = torch.tensor(sun_angles).float()
-        times = torch.cat([times, sun_angles], dim=-1)  # [N, 3]
+        angles = torch.as_tensor(
+            dataset.sun_angles, dtype=torch.float32, device=device
+        )  # [M, 2]
+        sun_azimuth = angles[torch.randint(0, len(angles), (N,), device=device), 0]
+        sun_altitude = angles[torch.randint(0, len(angles), (N,), device=device), 1]
+        sun_angles = torch.stack([sun_azimuth, sun_altitude], dim=-1)  # [N, 2]
+        sun_scales = torch.log(
+            torch.zeros_like(sun_angles)
+            + torch.std(sun_angles, dim=0, keepdim=True) * 3
+        )
 
     time_scales = torch.log(
         torch.zeros_like(times) + torch.std(times, dim=0, keepdim=True) * 3
@@ -240,7 +270,13 @@ def create_splats_with_optimizers(
     ]
 
     if use_shading:
-        d = times.shape[-1]  # number of time dimensions
+        # Sun angles are kept apart from the times, as separate [N, 2] fields
+        params.append(
+            ("sun_means", torch.nn.Parameter(sun_angles), means_lr * scene_scale)
+        )
+        params.append(("sun_scales", torch.nn.Parameter(sun_scales), scales_lr))
+
+        d = times.shape[-1] + sun_angles.shape[-1]  # number of time dimensions
         triu_len = d * (d - 1) // 2
         time_anisos = torch.zeros((N, triu_len), dtype=torch.float, device=device)
 
@@ -249,23 +285,127 @@ def create_splats_with_optimizers(
     splats = torch.nn.ParameterDict({n: v for n, v, _ in params}).to(device)
 
     optimizer_class = None
+    optimizer_kwargs = {}
     if sparse_grad:
         optimizer_class = torch.optim.SparseAdam
     elif visible_adam:
         optimizer_class = SelectiveAdam
     else:
         optimizer_class = torch.optim.Adam
+        optimizer_kwargs["fused"] = True
     optimizers = {
         name: optimizer_class(
             [{"params": splats[name], "lr": lr, "name": name}],
             eps=1e-15,
             betas=(0.9, 0.999),
+            **optimizer_kwargs,
         )
         for name, _, lr in params
     }
     return splats, optimizers
 
 
+def prep_gaussians(
+    scales: Tensor,
+    opacities: Tensor,
+    time_means: Tensor,
+    time_scales: Tensor,
+    times: Tensor,
+    colors: Tensor,
+    sun_means: Optional[Tensor] = None,
+    sun_scales: Optional[Tensor] = None,
+    sun_angles: Optional[Tensor] = None,
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """Activate the splat parameters and fold the time Gaussian into the opacities.
+
+    Pure elementwise math over the [N, ...] parameters, kept free of Python state so
+    that it can be fused by torch.compile.
+    """
+    assert (sun_means is None) == (
+        sun_angles is None
+    ), "sun_angles must be given exactly when the splats have sun_means."
+    scales = torch.exp(scales)  # [N, 3]
+    opacities = torch.sigmoid(opacities)  # [N,]
+
+    time_scales = torch.exp(time_scales)  # [N, d]
+    time_delta = times[None, ...] - time_means  # [N, d]
+    time_delta = time_delta / time_scales  # [N, d]
+
+    time_dist2 = (time_delta * time_delta).sum(dim=-1)  # [N,]
+
+    if sun_angles is not None:
+        sun_delta = (sun_angles[None, ...] - sun_means) / torch.exp(sun_scales)
+        time_dist2 = time_dist2 + (sun_delta * sun_delta).sum(dim=-1)
+
+    time_alpha = torch.exp(-0.5 * time_dist2)  # [N,]
+
+    opacities = opacities * time_alpha
+    colors = torch.sigmoid(colors)  # [N, 3]
+    return scales, opacities, colors
+
+
+def apply_color_pipeline(
+    colors: Tensor,
+    shading_colors: Optional[Tensor],
+    alphas: Tensor,
+    bil_grids: Optional[torch.nn.Module],
+    grid_xy: Optional[Tensor],
+    image_ids: Tensor,
+) -> Tensor:
+    """Shade and mask the rendered albedo, then apply the bilateral grid."""
+    if shading_colors is not None:
+        colors = colors * shading_colors
+    colors = colors * alphas
+
+    if bil_grids is not None:
+        colors = slice(
+            bil_grids,
+            grid_xy.expand(colors.shape[0], -1, -1, -1),
+            colors,
+            image_ids.unsqueeze(-1),
+        )["rgb"]
+    return colors
+
+
+def write_video_frames(writer, frames: queue.Queue, errors: List[Exception]) -> None:
+    """Append queued (pinned canvas, ready event) frames in order until None.
+
+    The first encoder exception is recorded in `errors`; the queue is still
+    drained so the producer never blocks.
+    """
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        if errors:
+            continue
+        canvas, ready = frame
+        try:
+            ready.synchronize()
+            writer.append_data(canvas.numpy())
+        except Exception as e:
+            errors.append(e)
+
+
+def composite_shading(
+    colors: Tensor, shading_colors: Tensor, shading_alphas: Optional[Tensor] = None
+) -> Tensor:
+    """Shade the albedo and clamp it to [0, 1].
+
+    If `shading_alphas` is given, the shading is composited over a white
+    background first.
+    """
+    if shading_alphas is not None:
+        shading_colors = shading_colors + (1.0 - shading_alphas)
+    return torch.clamp(colors * shading_colors, 0.0, 1.0)
+
+
+def save_canvas(path: str, canvas: Tensor, ready: torch.cuda.Event) -> None:
+    """Write a pinned [H, W, 3] uint8 canvas once its device copy has landed."""
+    ready.synchronize()
+    imageio.imwrite(path, canvas.numpy())
+
+
 class Runner:
     """Engine for training and testing."""
 
@@ -297,6 +437,15 @@ class Runner:
             data_factor=cfg.data_factor,
         )
         self.valset = TimeLapseDataset(cfg.data_dir, split="val")
+        # Kept alive across evaluations so the workers are not respawned.
+        self.valloader = torch.utils.data.DataLoader(
+            self.valset,
+            batch_size=1,
+            shuffle=False,
+            num_workers=2,
+            persistent_workers=True,
+            pin_memory=True,
+        )
         self.scene_scale = 1.1
         print("Scene scale:", self.scene_scale)
 
@@ -346,7 +495,8 @@ class Runner:
                 self.shading_splats, self.shading_optimizers
             )
 
-        print("Model initialized. Number of GS:", len(self.splats["means"]))
+        self.refresh_splat_cache()
+        print("Model initialized. Number of GS:", self._num_gs)
 
         if isinstance(self.cfg.strategy, DefaultStrategy):
             self.strategy_state = self.cfg.strategy.initialize_state(
@@ -393,10 +543,12 @@ class Runner:
                     self.app_module.embeds.parameters(),
                     lr=cfg.app_opt_lr * 10.0,
                     weight_decay=cfg.app_opt_reg,
+                    fused=True,
                 ),
                 torch.optim.Adam(
                     self.app_module.color_head.parameters(),
                     lr=cfg.app_opt_lr,
+                    fused=True,
                 ),
             ]
 
@@ -413,12 +565,72 @@ class Runner:
                     self.bil_grids.parameters(),
                     lr=2e-3,
                     eps=1e-15,
+                    fused=True,
                 ),
             ]
+            # Pixel coordinates for slicing the grid, keyed by image size.
+            self._grid_xy_cache = {}
+
+        # All optimizers, stepped in one sweep. Each is tagged with the splats it
+        # optimizes (if any), whose visibility mask SelectiveAdam steps with.
+        # Densification swaps parameters inside the optimizers, not the
+        # optimizers themselves, so this list stays valid.
+        self._all_optimizers: List[Tuple[Optional[str], torch.optim.Optimizer]] = (
+            [("splats", optimizer) for optimizer in self.optimizers.values()]
+            + [(None, optimizer) for optimizer in self.app_optimizers]
+            + [(None, optimizer) for optimizer in self.bil_grid_optimizers]
+        )
+        if cfg.use_shading:
+            self._all_optimizers += [
+                ("shading", optimizer) for optimizer in self.shading_optimizers.values()
+            ]
+
+        # Activations of the splat parameters and the image-space color pipelines
+        # of training and evaluation, optionally fused by torch.compile.
+        # The splat activations are compiled over the number of splats, which
+        # densification changes, so refinements do not trigger recompiles. They
+        # are fused without CUDA graphs: reduce-overhead would record a new graph
+        # for every splat count and never replay the old ones.
+        # CUDA graph trees are thread-local, so the viewer thread uses the
+        # eager functions.
+        self._prep_gaussians = prep_gaussians
+        self._apply_color_pipeline = apply_color_pipeline
+        self._composite_shading = composite_shading
+        if cfg.compile:
+            self._prep_gaussians = torch.compile(
+                prep_gaussians, mode="default", dynamic=True
+            )
+            self._apply_color_pipeline = torch.compile(
+                apply_color_pipeline, mode="reduce-overhead"
+            )
+            self._composite_shading = torch.compile(
+                composite_shading, mode="reduce-overhead", dynamic=False
+            )
+
+        # White background of the shading splats, kept on device and reused by
+        # every render.
+        self._shading_bkgd = torch.ones((1, 1), device=self.device)
+
+        # uint8 canvas of side-by-side images written by eval and render_traj.
+        self._canvas_gpu = None
+        # Encodes the images written by eval off the main thread.
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        # Homogeneous row of the trajectory cameras.
+        self._traj_bottom_row = torch.tensor(
+            [[[0.0, 0.0, 0.0, 1.0]]], device=self.device
+        )
+
+        # SelectiveAdam visibility masks, keyed by splat set.
+        self._vis_mask_bufs: Dict[str, Tensor] = {}
 
         # Losses & Metrics.
-        self.ssim = StructuralSimilarityIndexMeasure(data_range=1.0).to(self.device)
-        self.psnr = PeakSignalNoiseRatio(data_range=1.0).to(self.device)
+        # PSNR and SSIM are kept per image so batched scores average as before.
+        self.ssim = StructuralSimilarityIndexMeasure(
+            data_range=1.0, reduction="none"
+        ).to(self.device)
+        self.psnr = PeakSignalNoiseRatio(
+            data_range=1.0, reduction="none", dim=(1, 2, 3)
+        ).to(self.device)
 
         if cfg.lpips_net == "alex":
             self.lpips = LearnedPerceptualImagePatchSimilarity(
@@ -434,6 +646,27 @@ class Runner:
 
         # Viewer
         if not self.cfg.disable_viewer:
+            # Day bookkeeping of the time slider and persistent device inputs,
+            # filled in place every frame.
+            self._start_day = self.trainset.start_date.replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            end_day = self.trainset.end_date.replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            self._num_days = (end_day - self._start_day).days
+            self._unique_days_np = np.asarray(self.trainset.unique_days)
+            self._viewer_c2w = torch.eye(4, device=self.device)
+            self._viewer_times = torch.empty(1, device=self.device)
+            self._viewer_shading_times = torch.empty(1, device=self.device)
+            self._viewer_sun_angles = torch.empty(2, device=self.device)
+            self._viewer_bkgd = torch.empty((1, 3), device=self.device)
+            # The previous frame is read back before the next one starts, so
+            # its uploads from these buffers have finished by the time they are
+            # reused.
+            self._viewer_sun_angles_host = torch.empty(2, pin_memory=True)
+            self._viewer_bkgd_host = torch.empty((1, 3), pin_memory=True)
+
             self.server = viser.ViserServer(port=cfg.port, verbose=False)
             self.viewer = GsplatViewer(
                 server=self.server,
@@ -442,20 +675,60 @@ class Runner:
                 mode="training",
             )
 
+    def refresh_splat_cache(self) -> None:
+        """Refresh the cached splat parameters and counts.
+
+        Must be called whenever the splats are replaced, e.g. by densification
+        or when loading a checkpoint.
+        """
+        # (name, parameter) pairs of the splats.
+        self._splat_params: List[Tuple[str, torch.nn.Parameter]] = list(
+            self.splats.items()
+        )
+        # Number of splats.
+        self._num_gs = len(self.splats["means"])
+        self._num_shading_gs = (
+            len(self.shading_splats["means"]) if self.cfg.use_shading else 0
+        )
+
+    @staticmethod
+    def _splat_dim(splats: Dict[str, Tensor]) -> int:
+        """Dimension of the time (and sun angle) covariance of the splats."""
+        d = splats["times"].shape[-1]
+        if "sun_means" in splats:
+            d += splats["sun_means"].shape[-1]
+        return d
+
     def splat_cholesky(self, splats):
         """
         We parameterize a N-dimensional covariance with the LDL decomposition.
         L is an unitriangular matrix with real values.
         """
         N = splats["times"].shape[0]
-        d = splats["times"].shape[-1]
-        triu_len = (d * (d + 1)) // 2  # number of elements in the lower triangular part
-        tril = torch.tril_indices(d, d, offset=-1)
-        L = torch.eye(d, device=self.device).reshape(1, d, d).repeat(N, 1, 1)
-        if d > 1:
-            L[:, tril[0], tril[1]] = splats["time_anisos"]
+        d = self._splat_dim(splats)
+        if d == 1:
+            return torch.ones((N, 1, 1), device=self.device)
+
+        # Assemble small L directly from its entries, in tril_indices order,
+        # rather than scattering into a dense [N, d, d] identity.
+        anisos = splats["time_anisos"]  # [N, d * (d - 1) / 2]
+        ones = torch.ones_like(anisos[:, 0])
+        zeros = torch.zeros_like(anisos[:, 0])
+        if d == 2:
+            rows = [[ones, zeros], [anisos[:, 0], ones]]
+        elif d == 3:
+            rows = [
+                [ones, zeros, zeros],
+                [anisos[:, 0], ones, zeros],
+                [anisos[:, 1], anisos[:, 2], ones],
+            ]
+        else:
+            tril = torch.tril_indices(d, d, offset=-1, device=self.device)
+            L = torch.eye(d, device=self.device).reshape(1, d, d).repeat(N, 1, 1)
+            L[:, tril[0], tril[1]] = anisos
+            return L
 
-        return L
+        return torch.stack([torch.stack(row, dim=-1) for row in rows], dim=-2)
 
     def rasterize_splats(
         self,
@@ -467,39 +740,14 @@ class Runner:
         height: int,
         masks: Optional[Tensor] = None,
         rasterize_mode: Optional[Literal["classic", "antialiased"]] = None,
+        sun_angles: Optional[Tensor] = None,
+        compiled: bool = True,
         **kwargs,
     ) -> Tuple[Tensor, Tensor, Dict]:
         means = splats["means"]  # [N, 3]
         # quats = F.normalize(self.splats["quats"], dim=-1)  # [N, 4]
         # rasterization does normalization internally
         quats = splats["quats"]  # [N, 4]
-        scales = torch.exp(splats["scales"])  # [N, 3]
-        opacities = torch.sigmoid(splats["opacities"])  # [N,]
-
-        # Time Splatting
-        time_means = splats["times"]  # [N, d]
-        time_scales = torch.exp(splats["time_scales"])  # [N, d]
-        d = time_means.shape[-1]
-
-        time_delta = times[None, ...] - time_means  # [N, d]
-
-        """
-        # Upper triangular part of the time covariance matrix
-        if d > 1:
-            time_cholesky = self.splat_cholesky(splats).transpose(1, 2)  # [N, d, d]
-            # Anisotropic component of the time covariance times the time deltas
-            time_anisotropic = time_cholesky @ time_delta[..., None]  # [N, d, 1]
-            time_anisotropic = time_anisotropic.squeeze(-1)  # [N, d]
-
-        else:
-            time_anisotropic = time_delta
-        """
-        time_anisotropic = time_delta
-        time_delta = time_anisotropic / time_scales  # [N, d]
-
-        time_alpha = torch.exp(-0.5 * (time_delta * time_delta).sum(dim=-1))  # [N, 1]
-
-        opacities = opacities * time_alpha
 
         image_ids = kwargs.pop("image_ids", None)
         if self.cfg.app_opt:
@@ -510,10 +758,36 @@ class Runner:
                 sh_degree=kwargs.pop("sh_degree", self.cfg.sh_degree),
             )
             colors = colors + splats["colors"]
-            colors = torch.sigmoid(colors)
         else:
             colors = splats["colors"]  # [N, 3]
+
+        # Time Splatting
+        if self.cfg.fused_time_alpha:
+            scales = torch.exp(splats["scales"])  # [N, 3]
+            opacities = time_alpha_opacity(
+                times,
+                splats["times"],
+                splats["time_scales"],
+                splats["opacities"],
+                sun_angles=sun_angles,
+                sun_means=splats.get("sun_means"),
+                log_sun_scales=splats.get("sun_scales"),
+            )  # [N,]
             colors = torch.sigmoid(colors)  # [N, 3]
+        else:
+            # The viewer thread runs the eager function.
+            prep = self._prep_gaussians if compiled else prep_gaussians
+            scales, opacities, colors = prep(
+                scales=splats["scales"],
+                opacities=splats["opacities"],
+                time_means=splats["times"],
+                time_scales=splats["time_scales"],
+                times=times,
+                colors=colors,
+                sun_means=splats.get("sun_means"),
+                sun_scales=splats.get("sun_scales"),
+                sun_angles=sun_angles,
+            )
 
         if rasterize_mode is None:
             rasterize_mode = "antialiased" if self.cfg.antialiased else "classic"
@@ -524,7 +798,7 @@ class Runner:
             scales=scales,
             opacities=opacities,
             colors=colors,
-            viewmats=torch.linalg.inv(camtoworlds),  # [C, 4, 4]
+            viewmats=se3_inverse(camtoworlds),  # [C, 4, 4]
             Ks=Ks,  # [C, 3, 3]
             width=width,
             height=height,
@@ -543,6 +817,187 @@ class Runner:
             render_colors[~masks] = 0
         return render_colors, render_alphas, info
 
+    def _get_grid_xy(self, height: int, width: int) -> Tensor:
+        """Normalized pixel centers [1, H, W, 2] for slicing the bilateral grid."""
+        grid_xy = self._grid_xy_cache.get((height, width))
+        if grid_xy is None:
+            grid_y, grid_x = torch.meshgrid(
+                (torch.arange(height, device=self.device) + 0.5) / height,
+                (torch.arange(width, device=self.device) + 0.5) / width,
+                indexing="ij",
+            )
+            grid_xy = torch.stack([grid_x, grid_y], dim=-1).unsqueeze(0)
+            self._grid_xy_cache[(height, width)] = grid_xy
+        return grid_xy
+
+    def _image_metrics(self, colors: Tensor, pixels: Tensor) -> Dict[str, Tensor]:
+        """PSNR, SSIM and LPIPS of a [B, 3, H, W] batch, each of shape [B]."""
+        return {
+            "psnr": self.psnr(colors, pixels),
+            "ssim": self.ssim(colors, pixels),
+            # LPIPS only reduces over the batch; weight its mean by the batch size.
+            "lpips": self.lpips(colors, pixels).expand(len(colors)),
+        }
+
+    def _get_canvas(self, height: int, width: int) -> Tensor:
+        """[H, 2W, 3] uint8 device canvas, reallocated only on size change."""
+        shape = (height, 2 * width, 3)
+        if self._canvas_gpu is None or self._canvas_gpu.shape != shape:
+            self._canvas_gpu = torch.empty(shape, dtype=torch.uint8, device=self.device)
+        return self._canvas_gpu
+
+    def _visibility_mask(self, name: str, info: Dict) -> Tensor:
+        """Mask [N,] of the splats that were rendered, for SelectiveAdam.
+
+        `name` is the splat set, "splats" or "shading". The mask is written in
+        place into a buffer per set, reallocated only when densification
+        changes the number of splats.
+        """
+        N = self._num_gs if name == "splats" else self._num_shading_gs
+        visibility_mask = self._vis_mask_bufs.get(name)
+        if visibility_mask is None or len(visibility_mask) != N:
+            visibility_mask = torch.empty(N, dtype=torch.bool, device=self.device)
+            self._vis_mask_bufs[name] = visibility_mask
+        if self.cfg.packed:
+            visibility_mask.zero_()
+            visibility_mask.index_fill_(0, info["gaussian_ids"], True)
+        else:
+            # a splat is visible if both radii are positive in any camera
+            torch.any(info["radii"].amin(-1) > 0, dim=0, out=visibility_mask)
+        return visibility_mask
+
+    def _forward_backward(self, step: int, batch: Dict[str, Tensor]) -> Dict:
+        """Render a training batch, compute the loss and backpropagate it."""
+        cfg = self.cfg
+        if cfg.compile:
+            torch.compiler.cudagraph_mark_step_begin()
+        camtoworlds = batch["camtoworlds"]
+        Ks = batch["Ks"]
+        pixels = batch["pixels"]
+        image_ids = batch["image_ids"]
+        times = batch["times"]
+        alphas = batch["alphas"]
+        masks = batch.get("masks")
+        height, width = pixels.shape[1:3]
+
+        # forward
+        colors, _, info = self.rasterize_splats(
+            splats=self.splats,
+            times=times,
+            camtoworlds=camtoworlds,
+            Ks=Ks,
+            width=width,
+            height=height,
+            near_plane=cfg.near_plane,
+            far_plane=cfg.far_plane,
+            image_ids=image_ids,
+            render_mode="RGB",
+            masks=masks,
+        )
+
+        if cfg.use_shading:
+            shading_colors, shading_alphas, shading_info = self.rasterize_splats(
+                splats=self.shading_splats,
+                times=times,
+                sun_angles=batch["sun_angles"][0],  # [2]
+                camtoworlds=camtoworlds,
+                Ks=Ks,
+                width=width,
+                height=height,
+                near_plane=cfg.near_plane,
+                far_plane=cfg.far_plane,
+                image_ids=image_ids,
+                render_mode="RGB",
+                masks=masks,
+                backgrounds=self._shading_bkgd,
+            )
+        else:
+            shading_colors = None
+
+        colors = self._apply_color_pipeline(
+            colors=colors,
+            shading_colors=shading_colors,
+            alphas=alphas,
+            bil_grids=self.bil_grids if cfg.use_bilagrid else None,
+            grid_xy=self._get_grid_xy(height, width) if cfg.use_bilagrid else None,
+            image_ids=image_ids,
+        )
+
+        self.cfg.strategy.step_pre_backward(
+            params=self.splats,
+            optimizers=self.optimizers,
+            state=self.strategy_state,
+            step=step,
+            info=info,
+        )
+
+        if cfg.use_shading:
+            self.cfg.shading_strategy.step_pre_backward(
+                params=self.shading_splats,
+                optimizers=self.shading_optimizers,
+                state=self.shading_strategy_state,
+                step=step,
+                info=shading_info,
+            )
+
+        # loss
+        l1loss = F.l1_loss(colors, pixels)
+        # Permuting the contiguous NHWC images gives NCHW views that are already in
+        # channels-last memory format, so no transpose kernel or copy is issued.
+        colors_p = colors.permute(0, 3, 1, 2)  # [1, 3, H, W]
+        pixels_p = pixels.permute(0, 3, 1, 2)  # [1, 3, H, W]
+        ssimloss = 1.0 - fused_ssim(colors_p, pixels_p, padding="valid")
+        loss = l1loss * (1.0 - cfg.ssim_lambda) + ssimloss * cfg.ssim_lambda
+
+        if cfg.use_bilagrid:
+            tvloss = 10 * total_variation_loss(self.bil_grids.grids)
+            loss += tvloss
+
+        # regularizations, sigmoid and exp are positive so no abs is needed
+        if cfg.opacity_reg > 0.0:
+            loss = (
+                loss + cfg.opacity_reg * torch.sigmoid(self.splats["opacities"]).mean()
+            )
+
+            if cfg.use_shading:
+                loss = (
+                    loss
+                    + cfg.opacity_reg
+                    * torch.sigmoid(self.shading_splats["opacities"]).mean()
+                )
+
+        if cfg.scale_reg > 0.0:
+            loss = loss + cfg.scale_reg * torch.exp(self.splats["scales"]).mean()
+
+            loss += cfg.scale_reg * torch.exp(self.splats["time_scales"]).mean()
+
+            if cfg.use_shading:
+                loss += +cfg.scale_reg * torch.exp(self.shading_splats["scales"]).mean()
+
+                # mean over the time and sun scales together, as one [N, 3] field
+                time_scales = torch.exp(self.shading_splats["time_scales"])
+                sun_scales = torch.exp(self.shading_splats["sun_scales"])
+                loss += (
+                    cfg.scale_reg
+                    * (time_scales.sum() + sun_scales.sum())
+                    / (time_scales.numel() + sun_scales.numel())
+                )
+
+        loss.backward()
+
+        out = {
+            "loss": loss,
+            "l1loss": l1loss,
+            "ssimloss": ssimloss,
+            "colors": colors,
+            "info": info,
+        }
+        if cfg.use_bilagrid:
+            out["tvloss"] = tvloss
+        if cfg.use_shading:
+            out["shading_info"] = shading_info
+        return out
+
     def train(self):
         cfg = self.cfg
         device = self.device
@@ -586,7 +1041,7 @@ class Runner:
             persistent_workers=True,
             pin_memory=True,
         )
-        trainloader_iter = iter(trainloader)
+        prefetcher = CUDAPrefetcher(trainloader, device=device)
 
         # Training loop.
         global_tic = time.time()
@@ -598,45 +1053,31 @@ class Runner:
                 self.viewer.lock.acquire()
                 tic = time.time()
 
-            try:
-                data = next(trainloader_iter)
-            except StopIteration:
-                trainloader_iter = iter(trainloader)
-                data = next(trainloader_iter)
+            data = prefetcher.next()
 
-            camtoworlds = camtoworlds_gt = data["camtoworld"].to(device)  # [1, 4, 4]
-            Ks = data["K"].to(device)  # [1, 3, 3]
-            pixels = data["image"].to(device) / 255.0  # [1, H, W, 3]
+            pixels = data["image"] / 255.0  # [1, H, W, 3]
             num_train_rays_per_step = (
                 pixels.shape[0] * pixels.shape[1] * pixels.shape[2]
             )
-            image_ids = data["image_id"].to(device)
-            masks = data["mask"].to(device) if "mask" in data else None  # [1, H, W]
-
-            height, width = pixels.shape[1:3]
 
             times = (
-                data["time"].float().to(device)
+                data["time"].float()
                 + np.random.randn() * self.trainset.time_gap * cfg.time_noise_scale
             )
 
-            # forward
-            colors, _, info = self.rasterize_splats(
-                splats=self.splats,
-                times=times,
-                camtoworlds=camtoworlds,
-                Ks=Ks,
-                width=width,
-                height=height,
-                near_plane=cfg.near_plane,
-                far_plane=cfg.far_plane,
-                image_ids=image_ids,
-                render_mode="RGB",
-                masks=masks,
-            )
+            batch = {
+                "camtoworlds": data["camtoworld"],  # [1, 4, 4]
+                "Ks": data["K"],  # [1, 3, 3]
+                "pixels": pixels,
+                "image_ids": data["image_id"],
+                "times": times,
+                "alphas": data["alpha"] / 255,
+            }
+            if "mask" in data:
+                batch["masks"] = data["mask"]  # [1, H, W]
 
             if cfg.use_shading:
-                sun_angles = data["sun_angle"].float().to(device)
+                sun_angles = data["sun_angle"].float()
                 sun_angles[:, 0] += (
                     np.random.randn()
                     * self.trainset.sun_angle_std[0].item()
@@ -647,126 +1088,40 @@ class Runner:
                     * self.trainset.sun_angle_std[1].item()
                     * cfg.angle_noise_scale
                 )
-                times = torch.cat(
-                    [times, sun_angles[:, 0], sun_angles[:, 1]], dim=-1
-                )  # [C, 3]
-
-                shading_colors, shading_alphas, shading_info = self.rasterize_splats(
-                    splats=self.shading_splats,
-                    times=times,
-                    camtoworlds=camtoworlds,
-                    Ks=Ks,
-                    width=width,
-                    height=height,
-                    near_plane=cfg.near_plane,
-                    far_plane=cfg.far_plane,
-                    image_ids=image_ids,
-                    render_mode="RGB",
-                    masks=masks,
-                    backgrounds=torch.tensor([(1.0,)], device=self.device),
-                )
-                colors = colors * shading_colors
+                batch["sun_angles"] = sun_angles
 
-            alphas = data["alpha"].to(device) / 255
-            colors = colors * alphas
+            out = self._forward_backward(step, batch)
 
+            loss = out["loss"]
+            l1loss = out["l1loss"]
+            ssimloss = out["ssimloss"]
+            colors = out["colors"]
+            info = out["info"]
             if cfg.use_bilagrid:
-                grid_y, grid_x = torch.meshgrid(
-                    (torch.arange(height, device=self.device) + 0.5) / height,
-                    (torch.arange(width, device=self.device) + 0.5) / width,
-                    indexing="ij",
-                )
-                grid_xy = torch.stack([grid_x, grid_y], dim=-1).unsqueeze(0)
-                colors = slice(
-                    self.bil_grids,
-                    grid_xy.expand(colors.shape[0], -1, -1, -1),
-                    colors,
-                    image_ids.unsqueeze(-1),
-                )["rgb"]
-
-            self.cfg.strategy.step_pre_backward(
-                params=self.splats,
-                optimizers=self.optimizers,
-                state=self.strategy_state,
-                step=step,
-                info=info,
-            )
-
+                tvloss = out["tvloss"]
             if cfg.use_shading:
-                self.cfg.shading_strategy.step_pre_backward(
-                    params=self.shading_splats,
-                    optimizers=self.shading_optimizers,
-                    state=self.shading_strategy_state,
-                    step=step,
-                    info=shading_info,
-                )
-
-            # loss
-            l1loss = F.l1_loss(colors, pixels)
-            ssimloss = 1.0 - fused_ssim(
-                colors.permute(0, 3, 1, 2), pixels.permute(0, 3, 1, 2), padding="valid"
-            )
-            loss = l1loss * (1.0 - cfg.ssim_lambda) + ssimloss * cfg.ssim_lambda
-
-            if cfg.use_bilagrid:
-                tvloss = 10 * total_variation_loss(self.bil_grids.grids)
-                loss += tvloss
-
-            # regularizations
-            if cfg.opacity_reg > 0.0:
-                loss = (
-                    loss
-                    + cfg.opacity_reg
-                    * torch.abs(torch.sigmoid(self.splats["opacities"])).mean()
-                )
-
-                if cfg.use_shading:
-                    loss = (
-                        loss
-                        + cfg.opacity_reg
-                        * torch.abs(
-                            torch.sigmoid(self.shading_splats["opacities"])
-                        ).mean()
-                    )
-
-            if cfg.scale_reg > 0.0:
-                loss = (
-                    loss
-                    + cfg.scale_reg * torch.abs(torch.exp(self.splats["scales"])).mean()
-                )
-
-                loss += (
-                    cfg.scale_reg
-                    * torch.abs(torch.exp(self.splats["time_scales"])).mean()
-                )
-
-                if cfg.use_shading:
-                    loss += (
-                        +cfg.scale_reg
-                        * torch.abs(torch.exp(self.shading_splats["scales"])).mean()
-                    )
-
-                    loss += (
-                        cfg.scale_reg
-                        * torch.abs(
-                            torch.exp(self.shading_splats["time_scales"])
-                        ).mean()
-                    )
-
-            loss.backward()
-
-            desc = f"loss={loss.item():.3f}| "
+                shading_info = out["shading_info"]
+
+            # Losses are only read back every pbar_every or tb_every steps, in a
+            # single transfer, so that the host does not wait on the GPU every step.
+            log_tb = cfg.tb_every > 0 and step % cfg.tb_every == 0
+            log_pbar = cfg.pbar_every > 0 and step % cfg.pbar_every == 0
+            if log_tb or log_pbar:
+                scalars = {"loss": loss, "l1loss": l1loss, "ssimloss": ssimloss}
+                if cfg.use_bilagrid:
+                    scalars["tvloss"] = tvloss
+                values = torch.stack([v.detach() for v in scalars.values()]).tolist()
+                scalars = dict(zip(scalars.keys(), values))
 
-            pbar.set_description(desc)
+                desc = f"loss={scalars['loss']:.3f}| "
+                pbar.set_description(desc)
 
-            if cfg.tb_every > 0 and step % cfg.tb_every == 0:
+            if log_tb:
                 mem = torch.cuda.max_memory_allocated() / 1024**3
-                self.writer.add_scalar("train/loss", loss.item(), step)
-                self.writer.add_scalar("train/l1loss", l1loss.item(), step)
-                self.writer.add_scalar("train/ssimloss", ssimloss.item(), step)
-                self.writer.add_scalar("train/num_GS", len(self.splats["means"]), step)
-                if cfg.use_bilagrid:
-                    self.writer.add_scalar("train/tvloss", tvloss.item(), step)
+                for k, v in scalars.items():
+                    self.writer.add_scalar(f"train/{k}", v, step)
+                self.writer.add_scalar("train/num_GS", self._num_gs, step)
+                self.writer.add_scalar("train/mem", mem, step)
                 if cfg.tb_save_image:
                     canvas = torch.cat([pixels, colors], dim=2).detach().cpu().numpy()
                     canvas = canvas.reshape(-1, *canvas.shape[2:])
@@ -779,7 +1134,7 @@ class Runner:
                 stats = {
                     "mem": mem,
                     "ellipse_time": time.time() - global_tic,
-                    "num_GS": len(self.splats["means"]),
+                    "num_GS": self._num_gs,
                 }
                 print("Step: ", step, stats)
                 with open(
@@ -796,49 +1151,36 @@ class Runner:
             if cfg.sparse_grad:
                 assert cfg.packed, "Sparse gradients only work with packed mode."
                 gaussian_ids = info["gaussian_ids"]
-                for k in self.splats.keys():
-                    grad = self.splats[k].grad
+                for _, param in self._splat_params:
+                    grad = param.grad
                     if grad is None or grad.is_sparse:
                         continue
-                    self.splats[k].grad = torch.sparse_coo_tensor(
+                    param.grad = torch.sparse_coo_tensor(
                         indices=gaussian_ids[None],  # [1, nnz]
                         values=grad[gaussian_ids],  # [nnz, ...]
-                        size=self.splats[k].size(),  # [N, ...]
-                        is_coalesced=len(Ks) == 1,
+                        size=param.size(),  # [N, ...]
+                        is_coalesced=len(batch["Ks"]) == 1,
                     )
 
+            visibility_masks = {}
             if cfg.visible_adam:
-                gaussian_cnt = self.splats.means.shape[0]
-                if cfg.packed:
-                    visibility_mask = torch.zeros_like(
-                        self.splats["opacities"], dtype=bool
+                visibility_masks["splats"] = self._visibility_mask("splats", info)
+                if cfg.use_shading:
+                    visibility_masks["shading"] = self._visibility_mask(
+                        "shading", shading_info
                     )
-                    visibility_mask.scatter_(0, info["gaussian_ids"], 1)
-                else:
-                    visibility_mask = (info["radii"] > 0).all(-1).any(0)
 
             # optimize
-            for optimizer in self.optimizers.values():
-                if cfg.visible_adam:
-                    optimizer.step(visibility_mask)
+            for splats_name, optimizer in self._all_optimizers:
+                if splats_name in visibility_masks:
+                    optimizer.step(visibility_masks[splats_name])
                 else:
                     optimizer.step()
+            for _, optimizer in self._all_optimizers:
                 optimizer.zero_grad(set_to_none=True)
-            for optimizer in self.app_optimizers:
-                optimizer.step()
-                optimizer.zero_grad(set_to_none=True)
-            for optimizer in self.bil_grid_optimizers:
-                optimizer.step()
-                optimizer.zero_grad(set_to_none=True)
-            if cfg.use_shading:
-                for optimizer in self.shading_optimizers.values():
-                    if cfg.visible_adam:
-                        optimizer.step(visibility_mask)
-                    else:
-                        optimizer.step()
-                    optimizer.zero_grad(set_to_none=True)
             for scheduler in schedulers:
                 scheduler.step()
+            means_lr = schedulers[0].get_last_lr()[0]
 
             # Run post-backward steps after backward and optimizer
             if isinstance(self.cfg.strategy, DefaultStrategy):
@@ -857,7 +1199,7 @@ class Runner:
                     state=self.strategy_state,
                     step=step,
                     info=info,
-                    lr=schedulers[0].get_last_lr()[0],
+                    lr=means_lr,
                 )
             else:
                 assert_never(self.cfg.strategy)
@@ -880,11 +1222,14 @@ class Runner:
                         state=self.shading_strategy_state,
                         step=step,
                         info=shading_info,
-                        lr=schedulers[0].get_last_lr()[0],
+                        lr=means_lr,
                     )
                 else:
                     assert_never(self.cfg.strategy)
 
+            # The strategies may have replaced the splat parameters.
+            self.refresh_splat_cache()
+
             # eval the full set
             if step in [i - 1 for i in cfg.eval_steps]:
                 self.eval(step)
@@ -907,30 +1252,47 @@ class Runner:
                 # Update the scene.
                 self.viewer.update(step, num_train_rays_per_step)
 
-    @torch.no_grad()
-    def eval(self, step: int, stage: str = "val"):
-        """Entry for evaluation."""
+    @torch.inference_mode()
+    def eval(
+        self,
+        step: int,
+        stage: str = "val",
+        splats: Optional[Dict[str, Tensor]] = None,
+    ):
+        """Entry for evaluation of `splats`, the trained splats by default."""
         print("Running evaluation...")
         cfg = self.cfg
         device = self.device
-
-        valloader = torch.utils.data.DataLoader(
-            self.valset, batch_size=1, shuffle=False, num_workers=1
-        )
-        ellipse_time = 0
+        if splats is None:
+            splats = self.splats
+
+        # Render timings are recorded with CUDA events and read back once after
+        # the loop, and the PNGs are encoded off the main thread, so the loop
+        # never waits for the GPU.
+        render_events = []
+        # Pinned host canvases, each reused once its previous write is done,
+        # which bounds the number of pending writes.
+        canvases = [None] * 4
+        writes = [None] * 4
+        batch = defaultdict(list)
         metrics = defaultdict(list)
-        for i, data in enumerate(valloader):
-            camtoworlds = data["camtoworld"].to(device)
-            Ks = data["K"].to(device)
-            pixels = data["image"].to(device) / 255.0
-            masks = data["mask"].to(device) if "mask" in data else None
+        for i, data in enumerate(self.valloader):
+            camtoworlds = data["camtoworld"].to(device, non_blocking=True)
+            Ks = data["K"].to(device, non_blocking=True)
+            pixels = data["image"].to(device, non_blocking=True) / 255.0
+            masks = (
+                data["mask"].to(device, non_blocking=True) if "mask" in data else None
+            )
             height, width = pixels.shape[1:3]
 
-            torch.cuda.synchronize()
-            tic = time.time()
-            times = data["time"].float().to(device)
+            if cfg.compile:
+                torch.compiler.cudagraph_mark_step_begin()
+            start_evt = torch.cuda.Event(enable_timing=True)
+            end_evt = torch.cuda.Event(enable_timing=True)
+            start_evt.record()
+            times = data["time"].to(device, non_blocking=True).float()
             colors, _, _ = self.rasterize_splats(
-                splats=self.splats,
+                splats=splats,
                 times=times,
                 camtoworlds=camtoworlds,
                 Ks=Ks,
@@ -942,11 +1304,13 @@ class Runner:
             )  # [1, H, W, 3]
 
             if cfg.use_shading:
-                sun_angles = data["sun_angles"].float().to(device)
-                times = torch.cat([times, sun_angles[0], sun_angles[1]], dim=-1)
+                sun_angles = (
+                    data["sun_angle"].to(device, non_blocking=True).float()
+                )  # [1, 2]
                 shading_colors, shading_alphas, _ = self.rasterize_splats(
                     splats=self.shading_splats,
                     times=times,
+                    sun_angles=sun_angles[0],
                     camtoworlds=camtoworlds,
                     Ks=Ks,
                     width=width,
@@ -954,45 +1318,80 @@ class Runner:
                     near_plane=cfg.near_plane,
                     far_plane=cfg.far_plane,
                     masks=masks,
-                    backgrounds=torch.tensor([(1.0,)], device=self.device),
+                    backgrounds=self._shading_bkgd,
                 )
-                bkgd = torch.ones(1, 3, device=device)
-                shading_colors = shading_colors + bkgd * (1.0 - shading_alphas)
-                colors = colors * shading_colors
-
-            torch.cuda.synchronize()
-            ellipse_time += max(time.time() - tic, 1e-10)
+                colors = self._composite_shading(colors, shading_colors, shading_alphas)
+                if cfg.compile:
+                    # the compiled graph reuses its output for the next image,
+                    # while the metrics keep it for the batch
+                    colors = colors.clone()
+            else:
+                colors = torch.clamp(colors, 0.0, 1.0)
 
-            colors = torch.clamp(colors, 0.0, 1.0)
-            canvas_list = [pixels, colors]
+            end_evt.record()
+            render_events.append((start_evt, end_evt))
 
             # write images
-            canvas = torch.cat(canvas_list, dim=2).squeeze(0).cpu().numpy()
-            canvas = (canvas * 255).astype(np.uint8)
-            imageio.imwrite(
+            canvas = self._get_canvas(height, width)
+            canvas[:, :width].copy_(pixels[0] * 255)
+            canvas[:, width:].copy_(colors[0] * 255)
+            slot = i % len(canvases)
+            if writes[slot] is not None:
+                writes[slot].result()
+            if canvases[slot] is None or canvases[slot].shape != canvas.shape:
+                canvases[slot] = torch.empty(
+                    canvas.shape, dtype=canvas.dtype, pin_memory=True
+                )
+            canvases[slot].copy_(canvas, non_blocking=True)
+            ready = torch.cuda.Event()
+            ready.record()
+            writes[slot] = self._io_pool.submit(
+                save_canvas,
                 f"{self.render_dir}/{stage}_step{step}_{i:04d}.png",
-                canvas,
+                canvases[slot],
+                ready,
             )
 
-            pixels_p = pixels.permute(0, 3, 1, 2)  # [1, 3, H, W]
-            colors_p = colors.permute(0, 3, 1, 2)  # [1, 3, H, W]
-            metrics["psnr"].append(self.psnr(colors_p, pixels_p))
-            metrics["ssim"].append(self.ssim(colors_p, pixels_p))
-            metrics["lpips"].append(self.lpips(colors_p, pixels_p))
+            # score the images in batches
+            batch["pixels"].append(pixels)
+            batch["colors"].append(colors)
             if cfg.use_bilagrid:
-                cc_colors = color_correct(colors, pixels)
-                cc_colors_p = cc_colors.permute(0, 3, 1, 2)  # [1, 3, H, W]
-                metrics["cc_psnr"].append(self.psnr(cc_colors_p, pixels_p))
-                metrics["cc_ssim"].append(self.ssim(cc_colors_p, pixels_p))
-                metrics["cc_lpips"].append(self.lpips(cc_colors_p, pixels_p))
-
-        ellipse_time /= len(valloader)
-
-        stats = {k: torch.stack(v).mean().item() for k, v in metrics.items()}
+                # color correction is fit per image, so it is not batched
+                batch["cc_colors"].append(color_correct(colors, pixels))
+            if (
+                len(batch["pixels"]) == cfg.metrics_batch_size
+                or i == len(self.valloader) - 1
+            ):
+                pixels_p = torch.cat(batch["pixels"]).permute(0, 3, 1, 2)
+                for prefix, key in [("", "colors"), ("cc_", "cc_colors")]:
+                    if key not in batch:
+                        continue
+                    colors_p = torch.cat(batch[key]).permute(0, 3, 1, 2)
+                    for k, v in self._image_metrics(colors_p, pixels_p).items():
+                        metrics[prefix + k].append(v)
+                batch.clear()
+
+        for write in writes:
+            if write is not None:
+                write.result()
+        torch.cuda.synchronize()
+        ellipse_time = sum(
+            max(start.elapsed_time(end) / 1000, 1e-10) for start, end in render_events
+        )
+        ellipse_time /= len(self.valloader)
+
+        stats = {k: torch.cat(v).mean().item() for k, v in metrics.items()}
+        # The per-image metrics keep every score in their state; only the
+        # values returned above are used.
+        self.psnr.reset()
+        self.ssim.reset()
+        self.lpips.reset()
         stats.update(
             {
                 "ellipse_time": ellipse_time,
-                "num_GS": len(self.splats["means"]),
+                "num_GS": (
+                    self._num_gs if splats is self.splats else len(splats["means"])
+                ),
             }
         )
         if cfg.use_bilagrid:
@@ -1016,7 +1415,7 @@ class Runner:
             self.writer.add_scalar(f"{stage}/{k}", v, step)
         self.writer.flush()
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def render_traj(self, step: int):
         """Entry for trajectory rendering."""
         if self.cfg.disable_video:
@@ -1025,88 +1424,117 @@ class Runner:
         cfg = self.cfg
         device = self.device
 
-        camtoworlds_all = np.eye(4)[None, ...]  # self.parser.camtoworlds[5:-5]
+        # The time-lapse is captured from a single fixed camera, so its pose,
+        # intrinsics and image size are those of any dataset sample.
+        sample = self.trainset[0]
         if cfg.render_traj_path == "interp":
             camtoworlds_all = generate_interpolated_path(
-                camtoworlds_all, 1
-            )  # [N, 3, 4]
-        elif cfg.render_traj_path == "ellipse":
-            height = camtoworlds_all[:, 2, 3].mean()
-            camtoworlds_all = generate_ellipse_path_z(
-                camtoworlds_all, height=height
+                sample["camtoworld"].numpy()[None], cfg.traj_frames_per_pose
             )  # [N, 3, 4]
-        elif cfg.render_traj_path == "spiral":
-            camtoworlds_all = generate_spiral_path(
-                camtoworlds_all,
-                bounds=self.parser.bounds * self.scene_scale,
-                spiral_scale_r=self.parser.extconf["spiral_radius_scale"],
-            )
         else:
             raise ValueError(
                 f"Render trajectory type not supported: {cfg.render_traj_path}"
             )
 
-        camtoworlds_all = np.concatenate(
+        camtoworlds_all = torch.from_numpy(camtoworlds_all).float().to(device)
+        camtoworlds_all = torch.cat(
             [
                 camtoworlds_all,
-                np.repeat(
-                    np.array([[[0.0, 0.0, 0.0, 1.0]]]), len(camtoworlds_all), axis=0
-                ),
+                self._traj_bottom_row.expand(len(camtoworlds_all), 1, 4),
             ],
-            axis=1,
+            dim=1,
         )  # [N, 4, 4]
-
-        camtoworlds_all = torch.from_numpy(camtoworlds_all).float().to(device)
-        K = torch.from_numpy(list(self.parser.Ks_dict.values())[0]).float().to(device)
-        width, height = list(self.parser.imsize_dict.values())[0]
+        Ks = sample["K"].to(device)[None]  # [1, 3, 3]
+        height, width = sample["image"].shape[:2]
 
         # save to video
         video_dir = f"{cfg.result_dir}/videos"
         os.makedirs(video_dir, exist_ok=True)
         writer = imageio.get_writer(f"{video_dir}/traj_{step}.mp4", fps=30)
-        for i in tqdm.trange(len(camtoworlds_all), desc="Rendering trajectory"):
-            camtoworlds = camtoworlds_all[i : i + 1]
-            Ks = K[None]
-
-            renders, _, _ = self.rasterize_splats(
-                times=0.5,
-                camtoworlds=camtoworlds,
-                Ks=Ks,
-                width=width,
-                height=height,
-                near_plane=cfg.near_plane,
-                far_plane=cfg.far_plane,
-                render_mode="RGB+ED",
-            )  # [1, H, W, 4]
-            colors = torch.clamp(renders[..., 0:3], 0.0, 1.0)  # [1, H, W, 3]
-            depths = renders[..., 3:4]  # [1, H, W, 1]
-            depths = (depths - depths.min()) / (depths.max() - depths.min())
-            canvas_list = [colors, depths.repeat(1, 1, 1, 3)]
-
-            # write images
-            canvas = torch.cat(canvas_list, dim=2).squeeze(0).cpu().numpy()
-            canvas = (canvas * 255).astype(np.uint8)
-            writer.append_data(canvas)
-        writer.close()
+        # Frames are encoded in order by a single thread. The queue bounds the
+        # frames in flight, so a pinned canvas is free again by the time its
+        # slot comes around.
+        frames = queue.Queue(maxsize=8)
+        canvases = [None] * (frames.maxsize + 2)
+        encoder_errors: List[Exception] = []
+        encoder = threading.Thread(
+            target=write_video_frames, args=(writer, frames, encoder_errors)
+        )
+        encoder.start()
+        try:
+            num_frames = 0
+            times = torch.full((1,), 0.5, device=device)
+            # The frames share one time, so they are rasterized in batches of cameras.
+            for start in tqdm.trange(
+                0,
+                len(camtoworlds_all),
+                cfg.traj_batch_size,
+                desc="Rendering trajectory",
+            ):
+                if encoder_errors:
+                    break
+                camtoworlds = camtoworlds_all[start : start + cfg.traj_batch_size]
+
+                renders, _, _ = self.rasterize_splats(
+                    splats=self.splats,
+                    times=times,
+                    camtoworlds=camtoworlds,
+                    Ks=Ks.expand(len(camtoworlds), -1, -1),
+                    width=width,
+                    height=height,
+                    near_plane=cfg.near_plane,
+                    far_plane=cfg.far_plane,
+                    render_mode="RGB+ED",
+                )  # [B, H, W, 4]
+                for render in renders:
+                    colors = torch.clamp(render[..., 0:3], 0.0, 1.0)  # [H, W, 3]
+                    depths = render[..., 3:4]  # [H, W, 1]
+                    depths_min, depths_max = torch.aminmax(depths)
+                    depths = (depths - depths_min) / (depths_max - depths_min)
+
+                    # write images
+                    canvas = self._get_canvas(height, width)
+                    canvas[:, :width].copy_(colors * 255)
+                    canvas[:, width:].copy_((depths * 255).expand(-1, -1, 3))
+                    slot = num_frames % len(canvases)
+                    if canvases[slot] is None:
+                        canvases[slot] = torch.empty(
+                            canvas.shape, dtype=canvas.dtype, pin_memory=True
+                        )
+                    canvases[slot].copy_(canvas, non_blocking=True)
+                    ready = torch.cuda.Event()
+                    ready.record()
+                    frames.put((canvases[slot], ready))
+                    num_frames += 1
+        finally:
+            frames.put(None)
+            encoder.join()
+            writer.close()
+        if encoder_errors:
+            raise encoder_errors[0]
         print(f"Video saved to {video_dir}/traj_{step}.mp4")
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def run_compression(self, step: int):
         """Entry for running compression."""
         print("Running compression...")
+        cfg = self.cfg
 
         compress_dir = f"{cfg.result_dir}/compression"
         os.makedirs(compress_dir, exist_ok=True)
 
-        self.compression_method.compress(compress_dir, self.splats)
+        # The compressor rewrites entries of the mapping it is given (e.g. means
+        # into log space), so it gets a shallow copy and the trained parameters
+        # stay untouched.
+        self.compression_method.compress(compress_dir, dict(self.splats.items()))
 
         # evaluate compression
-        splats_c = self.compression_method.decompress(compress_dir)
-        for k in splats_c.keys():
-            self.splats[k].data = splats_c[k].to(self.device)
-        self.eval(step=step, stage="compress")
+        if cfg.eval_after_compression:
+            splats_c = self.compression_method.decompress(compress_dir)
+            splats_c = {k: v.to(self.device) for k, v in splats_c.items()}
+            self.eval(step=step, stage="compress", splats=splats_c)
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def _viewer_render_fn(
         self, camera_state: CameraState, render_tab_state: GsplatRenderTabState
     ):
@@ -1118,28 +1546,20 @@ class Runner:
             width = render_tab_state.viewer_width
             height = render_tab_state.viewer_height
         # c2w = camera_state.c2w
-        c2w = torch.eye(4).float().to(self.device)
+        c2w = self._viewer_c2w
         K = camera_state.get_K((width, height))
         K = torch.from_numpy(K).float().to(self.device)
 
-        end_day: datetime = self.trainset.end_date
-        end_day = end_day.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_day: datetime = self.trainset.start_date
-        start_day = start_day.replace(hour=0, minute=0, second=0, microsecond=0)
-        num_days = (end_day - start_day).days
-
-        days_elapsed = int(num_days * render_tab_state.time)
-        date: datetime = start_day + timedelta(
+        days_elapsed = int(self._num_days * render_tab_state.time)
+        date: datetime = self._start_day + timedelta(
             days=days_elapsed, seconds=render_tab_state.hour * 60 * 60
         )
-        left_idx = max(
-            bisect.bisect_left(self.trainset.unique_days, days_elapsed) - 1, 0
-        )
+        left_idx = max(int(np.searchsorted(self._unique_days_np, days_elapsed)) - 1, 0)
         right_idx = (
-            left_idx + 1 if left_idx + 1 < len(self.trainset.unique_days) else left_idx
+            left_idx + 1 if left_idx + 1 < len(self._unique_days_np) else left_idx
         )
-        left = self.trainset.unique_days[left_idx]
-        right = self.trainset.unique_days[right_idx]
+        left = self._unique_days_np[left_idx]
+        right = self._unique_days_np[right_idx]
 
         t = (days_elapsed - left) / (right - left + 1e-8)  # normalize to [0, 1]
         t = (
@@ -1147,7 +1567,11 @@ class Runner:
             + self.trainset.days_linspace[right_idx] * t
         )
 
-        times = torch.tensor([t]).float().cuda()
+        times = self._viewer_times.fill_(t)
+        self._viewer_bkgd_host[0] = (
+            torch.as_tensor(render_tab_state.backgrounds) / 255.0
+        )
+        self._viewer_bkgd.copy_(self._viewer_bkgd_host, non_blocking=True)
 
         render_colors, render_alphas, info = self.rasterize_splats(
             splats=self.splats,
@@ -1160,23 +1584,27 @@ class Runner:
             far_plane=render_tab_state.far_plane,
             radius_clip=render_tab_state.radius_clip,
             eps2d=render_tab_state.eps2d,
-            backgrounds=torch.tensor([render_tab_state.backgrounds], device=self.device)
-            / 255.0,
+            backgrounds=self._viewer_bkgd,
             render_mode="RGB",
             rasterize_mode=render_tab_state.rasterize_mode,
+            compiled=False,
         )  # [1, H, W, 3]
 
         if self.cfg.use_shading and render_tab_state.render_mode != "albedo":
-            angle = sun_angle(date)
-            angle = (angle[0] / 360, angle[1] / 90)  # normalize to [0, 1]
+            # Stage both angles on the host and upload them with one copy.
+            self._viewer_sun_angles_host[0], self._viewer_sun_angles_host[1] = (
+                normalized_sun_angle(date)
+            )
 
-            times = (
-                torch.tensor([render_tab_state.time, angle[0], angle[1]]).float().cuda()
+            times = self._viewer_shading_times.fill_(render_tab_state.time)
+            sun_angles = self._viewer_sun_angles.copy_(
+                self._viewer_sun_angles_host, non_blocking=True
             )
 
             shading_colors, shading_alphas, shading_info = self.rasterize_splats(
                 splats=self.shading_splats,
                 times=times,
+                sun_angles=sun_angles,
                 camtoworlds=c2w[None],
                 Ks=K[None],
                 width=width,
@@ -1185,30 +1613,31 @@ class Runner:
                 far_plane=render_tab_state.far_plane,
                 radius_clip=render_tab_state.radius_clip,
                 eps2d=render_tab_state.eps2d,
-                backgrounds=torch.tensor([(1.0,)], device=self.device),
+                backgrounds=self._shading_bkgd,
                 render_mode="RGB",
                 rasterize_mode=render_tab_state.rasterize_mode,
+                compiled=False,
             )  # [1, H, W, 3]
             if render_tab_state.render_mode == "full":
-                render_colors = render_colors * shading_colors
+                render_colors = composite_shading(render_colors, shading_colors)
             elif render_tab_state.render_mode == "shading":
                 render_colors = shading_colors.repeat(1, 1, 1, 3)
 
-        render_tab_state.total_gs_count = len(self.splats["means"])
-        render_tab_state.rendered_gs_count = (info["radii"] > 0).all(-1).sum().item()
+        # The rendered count stays on device until the frame is read back below,
+        # so counting does not stall the renders.
+        render_tab_state.total_gs_count = self._num_gs
+        rendered_gs_count = (info["radii"] > 0).all(-1).sum()
 
         if render_tab_state.render_mode != "albedo":
             if render_tab_state.render_mode == "full":
-                render_tab_state.total_gs_count += len(self.shading_splats["means"])
-                render_tab_state.rendered_gs_count += (
-                    (shading_info["radii"] > 0).all(-1).sum().item()
+                render_tab_state.total_gs_count += self._num_shading_gs
+                rendered_gs_count = (
+                    rendered_gs_count + (shading_info["radii"] > 0).all(-1).sum()
                 )
 
             elif self.cfg.use_shading:
-                render_tab_state.total_gs_count = len(self.shading_splats["means"])
-                render_tab_state.rendered_gs_count = (
-                    (shading_info["radii"] > 0).all(-1).sum().item()
-                )
+                render_tab_state.total_gs_count = self._num_shading_gs
+                rendered_gs_count = (shading_info["radii"] > 0).all(-1).sum()
 
         render_tab_state.date = date.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -1222,6 +1651,7 @@ class Runner:
             renders = (
                 apply_float_colormap(alpha, render_tab_state.colormap).cpu().numpy()
             )
+        render_tab_state.rendered_gs_count = rendered_gs_count.item()
         return renders
 
 
@@ -1236,6 +1666,7 @@ def main(local_rank: int, world_rank: int, world_size: int, cfg: Config):
         ]
         for k in runner.splats.keys():
             runner.splats[k].data = torch.cat([ckpt["splats"][k] for ckpt in ckpts])
+        runner.refresh_splat_cache()
         step = ckpts[0]["step"]
         runner.eval(step=step)
         runner.render_traj(step=step)
@@ -1285,6 +1716,9 @@ if __name__ == "__main__":
             total_variation_loss,
         )
 
+    if cfg.fused_time_alpha:
+        from time_alpha import time_alpha_opacity
+
     # try import extra dependencies
     if cfg.compression == "png":
         try:
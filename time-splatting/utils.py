@@ -97,7 +97,64 @@ def rotation_6d_to_matrix(d6: Tensor) -> Tensor:
     return torch.stack((b1, b2, b3), dim=-2)
 
 
-def knn(x: Tensor, K: int = 4) -> Tensor:
+def se3_inverse(T: Tensor) -> Tensor:
+    """Closed-form inverse of rigid transforms.
+
+    Args:
+        T: rigid transforms of size (*, 4, 4)
+
+    Returns:
+        inverse transforms of size (*, 4, 4)
+    """
+    R = T[..., :3, :3]
+    t = T[..., :3, 3:4]
+    Rt = R.transpose(-1, -2)
+    top = torch.cat([Rt, -Rt @ t], dim=-1)  # [*, 3, 4]
+    bottom = T[..., 3:4, :]  # [*, 1, 4]
+    return torch.cat([top, bottom], dim=-2)
+
+
+def generate_interpolated_path(poses: np.ndarray, n_interp: int) -> np.ndarray:
+    """Camera path through key poses, with `n_interp` frames per key pose.
+
+    Consecutive key poses are blended linearly and the blended rotations are
+    projected back onto SO(3). A single key pose is held for `n_interp` frames.
+
+    Args:
+        poses: camera-to-world key poses of size (N, 3, 4) or (N, 4, 4)
+        n_interp: number of frames per key pose
+
+    Returns:
+        camera-to-world poses of size (N * n_interp, 3, 4)
+    """
+    poses = poses[:, :3, :4]
+    if len(poses) == 1:
+        return np.repeat(poses, n_interp, axis=0)
+    t = np.linspace(0, len(poses) - 1, len(poses) * n_interp)
+    i = np.minimum(np.floor(t).astype(int), len(poses) - 2)
+    w = (t - i)[:, None, None]
+    path = (1 - w) * poses[i] + w * poses[i + 1]
+    U, _, Vt = np.linalg.svd(path[:, :, :3])
+    path[:, :, :3] = U @ Vt
+    return path
+
+
+def knn(x: Tensor, K: int = 4, chunk_size: int = 1024) -> Tensor:
+    """Distances to the K nearest neighbors of each point, including itself.
+
+    Point sets on the GPU are searched by brute force in chunks of `chunk_size`
+    rows, which caps the distance matrix at chunk_size x N. Large or CPU point
+    sets fall back to scikit-learn.
+    """
+    if x.is_cuda and len(x) < 200_000:
+        dists = [
+            torch.cdist(chunk, x, compute_mode="donot_use_mm_for_euclid_dist").topk(
+                K, dim=-1, largest=False
+            )[0]
+            for chunk in x.split(chunk_size)
+        ]
+        return torch.cat(dists)
+
     x_np = x.cpu().numpy()
     model = NearestNeighbors(n_neighbors=K, metric="euclidean").fit(x_np)
     distances, _ = model.kneighbors(x_np)